@@ -1,11 +1,35 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template, abort
 import os
-import openai
-import google.generativeai as genai 
-from google.generativeai import types  
+import io
+import re
+import json
 import base64
+import queue
+import threading
+import openai
+import httpx
 import time
+import uuid
+import sqlite3
+import hashlib
+import tempfile
+import contextlib
+import contextvars
+import importlib.util
+from statistics import NormalDist
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from cachetools import TTLCache
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+from tenacity import Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
 from flask_cors import CORS
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.wsgi import wrap_file
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
 
 app = Flask(__name__, template_folder=os.path.join(os.path.dirname(__file__), '..', 'templates'))
 CORS(app)
@@ -13,54 +37,1166 @@ print("🔥 Flask app is starting...")
 
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 GENAI_API_KEY = os.getenv("GENAI_API_KEY")
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+GENAI_BASE_URL = os.getenv("GENAI_BASE_URL", "https://generativelanguage.googleapis.com")
 
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "32"))
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "1") == "1" and importlib.util.find_spec("h2") is not None
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", "3"))
+UPSTREAM_MAX_BACKOFF = float(os.getenv("UPSTREAM_MAX_BACKOFF", "8"))
+BREAKER_THRESHOLD = int(os.getenv("BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+
+# One keep-alive pool shared by both providers.
+http_client = httpx.Client(
+    http2=UPSTREAM_HTTP2,
+    limits=httpx.Limits(
+        max_connections=UPSTREAM_MAX_CONNECTIONS,
+        max_keepalive_connections=UPSTREAM_MAX_CONNECTIONS,
+        keepalive_expiry=60
+    ),
+    timeout=httpx.Timeout(40, connect=5)
+)
 
 openai_router_client = openai.OpenAI(
     api_key=OPENROUTER_API_KEY,
-    base_url="https://openrouter.ai/api/v1"
+    base_url=OPENROUTER_BASE_URL,
+    http_client=http_client,
+    max_retries=0
 )
 
-genai.configure(api_key=GENAI_API_KEY)
+class CircuitOpen(Exception):
+    pass
+
+class StreamInterrupted(Exception):
+    pass
+
+class CircuitBreaker:
+    # Opens after BREAKER_THRESHOLD consecutive failures and fails fast until
+    # BREAKER_COOLDOWN has passed; then lets a single trial call through.
+    # hold() opens it for as long as the server asked us to stay away.
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = None
+        self.lock = threading.Lock()
+
+    def is_open(self):
+        with self.lock:
+            return self.open_until is not None and time.monotonic() < self.open_until
+
+    def allow(self):
+        with self.lock:
+            if self.open_until is None:
+                return True
+            if time.monotonic() >= self.open_until:
+                self.open_until = time.monotonic() + self.cooldown
+                return True
+            return False
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.open_until = None
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.open_until = time.monotonic() + self.cooldown
+
+    def hold(self, seconds):
+        with self.lock:
+            self.open_until = max(self.open_until or 0, time.monotonic() + seconds)
 
-def ask_gpt(prompt, model="openai/gpt-4.1-nano"):
+breakers = {}
+breakers_lock = threading.Lock()
+
+def breaker_for(model):
+    with breakers_lock:
+        if model not in breakers:
+            breakers[model] = CircuitBreaker()
+        return breakers[model]
+
+def is_retryable(e):
+    if isinstance(e, (openai.APIConnectionError, httpx.TransportError)):
+        return True
+    if isinstance(e, (openai.APIStatusError, httpx.HTTPStatusError)):
+        return e.response.status_code in (408, 429) or e.response.status_code >= 500
+    return False
+
+def retry_after(e):
+    response = getattr(e, "response", None)
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
     try:
-        response = openai_router_client.chat.completions.create(
-            model=model,
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=800,
-            timeout=40
-        )
-        return response.choices[0].message.content.strip()
+        return float(value)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+jittered_backoff = wait_random_exponential(multiplier=0.5, max=UPSTREAM_MAX_BACKOFF)
+
+def should_retry(e):
+    # A Retry-After beyond our longest backoff can't be honoured by waiting
+    # in-request; retrying early would only be refused again.
+    return is_retryable(e) and (retry_after(e) or 0) <= UPSTREAM_MAX_BACKOFF
+
+def upstream_wait(retry_state):
+    # Honour the server's Retry-After when it asks for longer than our backoff.
+    hint = retry_after(retry_state.outcome.exception()) or 0
+    return min(max(hint, jittered_backoff(retry_state)), UPSTREAM_MAX_BACKOFF)
+
+def call_upstream(model, fn):
+    breaker = breaker_for(model)
+    if not breaker.allow():
+        raise CircuitOpen(f"{model} is failing, skipping it for now")
+    try:
+        result = Retrying(
+            stop=stop_after_attempt(UPSTREAM_RETRIES),
+            wait=upstream_wait,
+            retry=retry_if_exception(should_retry),
+            reraise=True
+        )(fn)
     except Exception as e:
-        return f"[GPT Error]: {e}"
+        hint = retry_after(e) if is_retryable(e) else None
+        if hint and hint > UPSTREAM_MAX_BACKOFF:
+            breaker.hold(hint)
+        elif is_retryable(e) or isinstance(e, StreamInterrupted):
+            breaker.failure()
+        raise
+    breaker.success()
+    return result
+
+TRACING = os.getenv("TRACING", "1") == "1"
+LOG_JSON = os.getenv("LOG_JSON", "0") == "1"
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60)
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+class Metrics:
+    # Minimal Prometheus registry: labelled counters and fixed-bucket histograms.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = [[0] * len(LATENCY_BUCKETS), 0.0, 0]
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    hist[0][i] += 1
+            hist[1] += value
+            hist[2] += 1
+
+    def render(self, extra_counters=(), gauges=()):
+        def fmt(labels):
+            return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}" if labels else ""
+
+        lines, typed = [], set()
+        with self.lock:
+            counters = sorted([*self.counters.items(), *extra_counters])
+            histograms = sorted(self.histograms.items())
+        for (name, labels), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{fmt(labels)} {value}")
+        for (name, labels), value in sorted(gauges):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name}{fmt(labels)} {value}")
+        for (name, labels), (buckets, total, count) in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            for bound, n in zip(LATENCY_BUCKETS, buckets):
+                lines.append(f"{name}_bucket{fmt((*labels, ('le', bound)))} {n}")
+            lines.append(f"{name}_bucket{fmt((*labels, ('le', '+Inf')))} {count}")
+            lines.append(f"{name}_sum{fmt(labels)} {total}")
+            lines.append(f"{name}_count{fmt(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+def log_event(event, **fields):
+    if LOG_JSON:
+        print(json.dumps({"ts": round(time.time(), 3), "event": event, "request_id": request_id.get(), **fields}, default=str), flush=True)
+
+class Span:
+    # Times one model call. Labels become metric labels; fields set during
+    # the call (ttft, token counts) are recorded and logged.
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+        self.fields = {}
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def label(self, **labels):
+        self.labels.update(labels)
+
+    def __enter__(self):
+        self.token = current_span.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        current_span.reset(self.token)
+        self.labels["error"] = exc_type.__name__ if exc_type else ""
+        metrics.observe(f"ask_{self.name}_seconds", duration, **self.labels)
+        model = self.labels.get("model")
+        if "ttft" in self.fields:
+            metrics.observe("ask_upstream_ttft_seconds", self.fields["ttft"], model=model)
+        for kind in ("prompt", "completion"):
+            if self.fields.get(f"{kind}_tokens"):
+                metrics.inc("ask_tokens_total", self.fields[f"{kind}_tokens"], model=model, kind=kind)
+        log_event(self.name, duration=round(duration, 4), **self.labels, **self.fields)
+        return False
+
+class NoopSpan:
+    def set(self, **fields):
+        pass
+
+    def label(self, **labels):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NOOP_SPAN = NoopSpan()
+current_span = contextvars.ContextVar("current_span", default=NOOP_SPAN)
+
+def span(name, **labels):
+    return Span(name, **labels) if TRACING else NOOP_SPAN
+
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "8"))
+pipeline_pool = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="ask-stage")
+
+CACHE_TTL = int(os.getenv("CACHE_TTL", "3600"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CACHE_SHARED = os.getenv("CACHE_SHARED", "sqlite")
+CACHE_DB = os.getenv("CACHE_DB", os.path.join(tempfile.gettempdir(), "ask_cache.sqlite3"))
+
+cache_enabled = contextvars.ContextVar("cache_enabled", default=True)
+stage_info = contextvars.ContextVar("stage_info", default=None)
+STAGE_CANCEL_POLL = 0.1
+
+class StageCancelled(Exception):
+    pass
+
+def stage_cancelled():
+    # Set by run_pipeline once a stage misses its deadline, so work it left
+    # running stops at its next token instead of holding a worker.
+    info = stage_info.get()
+    return info is not None and info.get("cancelled", False)
+
+def normalize_prompt(prompt):
+    return " ".join(prompt.split())
+
+def cache_key(*parts):
+    return hashlib.sha256("\x1f".join(str(p) for p in parts).encode()).hexdigest()
+
+class SQLiteCache:
+    # Shared tier: survives across serverless invocations that land on the
+    # same instance (or share a mounted volume).
+    def __init__(self, path):
+        self.path = path
+        with self.connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires REAL)")
+
+    @contextlib.contextmanager
+    def connect(self):
+        # sqlite3's own context manager commits but never closes, which would
+        # leave a connection open per call until it is garbage collected.
+        db = sqlite3.connect(self.path, timeout=5)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def get(self, key):
+        with self.connect() as db:
+            row = db.execute("SELECT value, expires FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl):
+        with self.connect() as db:
+            db.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?)", (key, json.dumps(value), time.time() + ttl))
+
+    def delete(self, key):
+        with self.connect() as db:
+            db.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+class ResponseCache:
+    # In-process TTL/LRU tier in front of an optional shared tier, with
+    # single-flight so concurrent identical calls share one upstream request.
+    def __init__(self, shared=None, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES):
+        self.local = TTLCache(maxsize=max_bytes, ttl=ttl, getsizeof=len)
+        self.shared = shared
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.stats = {"local_hits": 0, "shared_hits": 0, "misses": 0, "coalesced": 0, "bypassed": 0, "errors": 0}
+
+    def count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def mark_hit(self):
+        info = stage_info.get()
+        if info is not None:
+            info["cached"] = True
+
+    def get_or_compute(self, key, compute):
+        if not cache_enabled.get():
+            self.count("bypassed")
+            return compute()
+
+        with self.lock:
+            if key in self.local:
+                self.stats["local_hits"] += 1
+                self.mark_hit()
+                return self.local[key]
+            leader = key not in self.inflight
+            if leader:
+                self.inflight[key] = Future()
+            else:
+                self.stats["coalesced"] += 1
+            fut = self.inflight[key]
+
+        if not leader:
+            self.mark_hit()
+            return fut.result()
+
+        try:
+            value = self.shared_get(key)
+            if value is not None:
+                self.count("shared_hits")
+                self.mark_hit()
+            else:
+                self.count("misses")
+                value = compute()
+                if value is not None:
+                    self.shared_set(key, value)
+            if value is not None and len(value) <= self.local.maxsize:
+                with self.lock:
+                    self.local[key] = value
+            fut.set_result(value)
+            return value
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.local.pop(key, None)
+        if self.shared is not None:
+            try:
+                self.shared.delete(key)
+            except Exception as e:
+                self.count("errors")
+                print("❌ Cache write error:", e)
+
+    def shared_get(self, key):
+        if self.shared is None:
+            return None
+        try:
+            return self.shared.get(key)
+        except Exception as e:
+            self.count("errors")
+            print("❌ Cache read error:", e)
+            return None
+
+    def shared_set(self, key, value):
+        if self.shared is None:
+            return
+        try:
+            self.shared.set(key, value, self.ttl)
+        except Exception as e:
+            self.count("errors")
+            print("❌ Cache write error:", e)
+
+response_cache = ResponseCache(shared=SQLiteCache(CACHE_DB) if CACHE_SHARED == "sqlite" else None)
+
+DEFAULT_ROUTES = {
+    "refiner": ["openai/gpt-4.1-nano", "openai/gpt-4o-mini"],
+    "answerer": ["openai/gpt-4.1-nano", "openai/gpt-4o-mini"],
+    "alt_answerer": ["deepseek/deepseek-chat", "openai/gpt-4o-mini"],
+    "merger": ["openai/gpt-4.1-nano", "openai/gpt-4o-mini"],
+    "prompt_writer": ["openai/gpt-4.1-nano", "openai/gpt-4o-mini"],
+}
+
+def load_routes():
+    # Roles map to an ordered list of models: the first healthy one is tried
+    # first and the rest are hedges/fallbacks. MODEL_ROUTES_FILE and
+    # MODEL_ROUTES (JSON) override individual roles.
+    routes = dict(DEFAULT_ROUTES)
+    if os.getenv("MODEL_ROUTES_FILE"):
+        with open(os.getenv("MODEL_ROUTES_FILE")) as f:
+            routes.update(json.load(f))
+    if os.getenv("MODEL_ROUTES"):
+        routes.update(json.loads(os.getenv("MODEL_ROUTES")))
+    return routes
+
+MODEL_ROUTES = load_routes()
+HEDGING = os.getenv("HEDGING", "1") == "1"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "3"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.25"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "5"))
+LATENCY_ALPHA = float(os.getenv("LATENCY_ALPHA", "0.2"))
+
+# Attempts run here rather than on their own threads, so hedging can't put
+# more calls in flight than the upstream connection pool holds.
+upstream_pool = ThreadPoolExecutor(max_workers=UPSTREAM_MAX_CONNECTIONS, thread_name_prefix="ask-upstream")
+
+class HedgeCancelled(Exception):
+    pass
+
+class LatencyStats:
+    # Exponentially weighted mean and variance; a percentile is estimated as
+    # mean + z * stddev, which is cheap and adapts as a model speeds up or slows down.
+    def __init__(self, alpha=LATENCY_ALPHA):
+        self.alpha = alpha
+        self.mean = None
+        self.var = 0.0
+        self.samples = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.samples += 1
+            if self.mean is None:
+                self.mean = value
+                return
+            diff = value - self.mean
+            self.mean += self.alpha * diff
+            self.var = (1 - self.alpha) * (self.var + self.alpha * diff * diff)
+
+    def percentile(self, p):
+        with self.lock:
+            return self.mean + NormalDist().inv_cdf(p) * self.var ** 0.5
+
+    def snapshot(self):
+        with self.lock:
+            return {"mean": self.mean, "stddev": self.var ** 0.5, "samples": self.samples}
+
+model_stats = {}
+model_stats_lock = threading.Lock()
+
+def stats_for(model):
+    with model_stats_lock:
+        if model not in model_stats:
+            model_stats[model] = {"ttft": LatencyStats(), "total": LatencyStats()}
+        return model_stats[model]
+
+def hedge_delay(model):
+    ttft = stats_for(model)["ttft"]
+    if ttft.samples < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_DELAY
+    return max(HEDGE_MIN_DELAY, ttft.percentile(HEDGE_PERCENTILE))
+
+def route_order(models):
+    # The configured order is a preference, not a speed ranking: alt_answerer
+    # exists to get a second model's view, so learned latency only sets hedge
+    # deadlines and never promotes a fallback ahead of the primary.
+    healthy = [m for m in models if not breaker_for(m).is_open()]
+    return healthy or list(models)
+
+def route_chat(models, prompt, timeout=40, on_delta=None, max_tokens=800, response_format=None):
+    # Starts the first healthy model; if it has no first token by its
+    # learned TTFT percentile, races the next model against it. Whichever
+    # streams first wins and the other is cancelled at its next token. A model
+    # that fails outright hands over to the next one in the list.
+    remaining = route_order(models)
+    cond = threading.Condition()
+    attempts = []
+    state = {"winner": None}
+
+    def claim(a):
+        if state["winner"] is None:
+            state["winner"] = a
+            for other in attempts:
+                if other is not a:
+                    other["cancelled"] = True
+            cond.notify_all()
+
+    def token(a, text):
+        with cond:
+            if not a["first_token"]:
+                # Losers are sampled too, so a model that is always hedged
+                # still learns how slow it is and gets hedged sooner.
+                a["first_token"] = True
+                ttft = time.monotonic() - a["started"]
+                stats_for(a["model"])["ttft"].observe(ttft)
+                current_span.get().set(ttft=round(ttft, 4))
+            if a["cancelled"]:
+                raise HedgeCancelled()
+            if stage_cancelled():
+                raise StageCancelled()
+            if state["winner"] is None:
+                claim(a)
+        if on_delta:
+            on_delta(text)
+
+    def cancel_all():
+        for a in attempts:
+            a["cancelled"] = True
+
+    def run(a):
+        a["started"] = time.monotonic()
+        try:
+            if a["cancelled"]:
+                # Still queued when the call was decided or timed out.
+                raise HedgeCancelled()
+            with span("upstream", model=a["model"]):
+                result = call_upstream(a["model"], lambda: chat_once(
+                    prompt, a["model"], timeout, lambda text: token(a, text), max_tokens, response_format
+                ))
+            stats_for(a["model"])["total"].observe(time.monotonic() - a["started"])
+            with cond:
+                a["result"] = result
+                claim(a)
+        except Exception as e:
+            a["error"] = e
+        finally:
+            with cond:
+                a["done"] = True
+                cond.notify_all()
+
+    def start(model):
+        a = {"model": model, "started": time.monotonic(), "first_token": False, "cancelled": False, "done": False,
+             "result": None, "error": None}
+        attempts.append(a)
+        upstream_pool.submit(contextvars.copy_context().run, run, a)
+        return time.monotonic() + hedge_delay(model)
+
+    end = time.monotonic() + timeout
+    with cond:
+        hedge_at = start(remaining.pop(0))
+        while state["winner"] is None:
+            live = [a for a in attempts if not a["done"]]
+            now = time.monotonic()
+            if remaining and (not live or (HEDGING and len(live) < 2 and now >= hedge_at)):
+                hedge_at = start(remaining.pop(0))
+                continue
+            if not live:
+                raise attempts[0]["error"]
+            if stage_cancelled():
+                cancel_all()
+                raise StageCancelled()
+            if now >= end:
+                cancel_all()
+                raise TimeoutError(f"No response from {', '.join(a['model'] for a in attempts)}")
+            wake = min(hedge_at, end) if remaining and HEDGING and len(live) < 2 else end
+            cond.wait(max(0.0, min(wake - now, STAGE_CANCEL_POLL)))
+
+        winner = state["winner"]
+        while not winner["done"]:
+            cond.wait()
+
+    info = stage_info.get()
+    if info is not None:
+        info["model"] = winner["model"]
+        info["attempts"] = [a["model"] for a in attempts]
+    if winner["error"]:
+        raise winner["error"]
+    return winner["result"]
+
+def chat(prompt, role, timeout=40, on_delta=None, max_tokens=800, response_format=None):
+    models = MODEL_ROUTES[role]
+    key = cache_key("chat", ",".join(models), normalize_prompt(prompt), max_tokens, json.dumps(response_format))
+    computed = []
+
+    def compute():
+        computed.append(True)
+        return route_chat(models, prompt, timeout, on_delta, max_tokens, response_format)
 
-def ask_deepseek(prompt):
+    with span("call", call=role, cache_hit="false") as sp:
+        text = response_cache.get_or_compute(key, compute)
+        sp.label(cache_hit=str(not computed).lower())
+    if on_delta is not None and not computed:
+        on_delta(text)
+    return text
+
+def chat_once(prompt, model, timeout=40, on_delta=None, max_tokens=800, response_format=None):
+    extra = {"response_format": response_format} if response_format else {}
+    stream = openai_router_client.chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        max_tokens=max_tokens,
+        timeout=timeout,
+        stream=True,
+        stream_options={"include_usage": True},
+        **extra
+    )
+    parts = []
     try:
-        response = openai_router_client.chat.completions.create(
-            model="deepseek/deepseek-chat",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=800,
-            timeout=40
-        )
-        return response.choices[0].message.content.strip()
+        for chunk in stream:
+            if chunk.usage:
+                current_span.get().set(prompt_tokens=chunk.usage.prompt_tokens, completion_tokens=chunk.usage.completion_tokens)
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                on_delta(chunk.choices[0].delta.content)
+    except (HedgeCancelled, StageCancelled):
+        stream.close()
+        raise
     except Exception as e:
-        return f"[DeepSeek Error]: {e}"
+        if not parts:
+            raise
+        # Deltas already went out to the client, so a retry would duplicate them.
+        raise StreamInterrupted(f"{model} stream broke off: {e}") from e
+    return "".join(parts).strip()
+
+def ask_gpt(prompt, role="answerer", timeout=40, on_delta=None, max_tokens=800, response_format=None):
+    return chat(prompt, role, timeout, on_delta, max_tokens, response_format)
+
+def ask_deepseek(prompt, timeout=40, on_delta=None):
+    return chat(prompt, "alt_answerer", timeout, on_delta)
+
+IMAGE_MODEL = "gemini-2.0-flash-preview-image-generation"
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "png").lower()
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "0"))
+BLOB_DIR = os.getenv("BLOB_DIR", os.path.join(tempfile.gettempdir(), "ask_images"))
+
+IMAGE_MIMETYPES = [
+    (b"\x89PNG", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"RIFF", "image/webp"),
+]
+
+class LocalBlobStore:
+    # Content-addressed: a blob's name is the sha256 of its bytes, so it can
+    # be served as immutable and written without coordination. Another backend
+    # only needs put/exists/url/open/size; /images/<digest> serves whatever
+    # open() returns, and a store whose url() points elsewhere bypasses it.
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return digest
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def open(self, digest):
+        return open(self.path(digest), "rb")
+
+    def size(self, digest):
+        return os.path.getsize(self.path(digest))
+
+    def url(self, digest):
+        return f"/images/{digest}"
+
+blob_store = LocalBlobStore(BLOB_DIR)
+
+def reencode_image(data):
+    if Image is None or (IMAGE_FORMAT == "png" and not IMAGE_MAX_SIDE):
+        return data
+    img = Image.open(io.BytesIO(data))
+    if IMAGE_MAX_SIDE:
+        img.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE))
+    if IMAGE_FORMAT == "jpeg":
+        img = img.convert("RGB")
+    out = io.BytesIO()
+    img.save(out, format=IMAGE_FORMAT.upper(), quality=85)
+    return out.getvalue()
 
 def generate_image(prompt):
     print(f"🎨 Gemini image prompt: {prompt}")
+    key = cache_key("image", IMAGE_MODEL, normalize_prompt(prompt), IMAGE_FORMAT, IMAGE_MAX_SIDE)
+    computed = []
+
+    def compute():
+        computed.append(True)
+        return blob_store.put(reencode_image(generate_image_upstream(prompt)))
+
     try:
-        model = genai.GenerativeModel("gemini-2.0-flash-preview-image-generation")
-        resp = model.generate_content(
-            prompt,
-            generation_config=types.GenerationConfig(response_modality=["IMAGE"])
-        )
-        for part in resp.candidates[0].content.parts:
-            if hasattr(part, "inline_data") and part.inline_data is not None:
-                return base64.b64encode(part.inline_data.data).decode()
-        return None
+        with span("call", call="image", cache_hit="false") as sp:
+            digest = response_cache.get_or_compute(key, compute)
+            if not blob_store.exists(digest):
+                # The shared cache outlived this instance's blob directory.
+                response_cache.invalidate(key)
+                digest = response_cache.get_or_compute(key, compute)
+            sp.label(cache_hit=str(not computed).lower())
+        return blob_store.url(digest)
     except Exception as e:
+        # Re-raised so the image stage is recorded as an error, not an ok None.
         print("❌ Gemini image error:", e)
+        raise
+
+def generate_image_upstream(prompt, timeout=60):
+    def once():
+        resp = http_client.post(
+            f"{GENAI_BASE_URL}/v1beta/models/{IMAGE_MODEL}:generateContent",
+            headers={"x-goog-api-key": GENAI_API_KEY or ""},
+            json={
+                "contents": [{"parts": [{"text": prompt}]}],
+                "generationConfig": {"responseModalities": ["TEXT", "IMAGE"]}
+            },
+            timeout=timeout
+        )
+        resp.raise_for_status()
+        return resp.json()
+
+    with span("upstream", model=IMAGE_MODEL) as sp:
+        data = call_upstream(IMAGE_MODEL, once)
+        usage = data.get("usageMetadata", {})
+        sp.set(prompt_tokens=usage.get("promptTokenCount"), completion_tokens=usage.get("candidatesTokenCount"))
+    for part in data["candidates"][0]["content"]["parts"]:
+        if "inlineData" in part:
+            return base64.b64decode(part["inlineData"]["data"])
+    raise ValueError("No image in response")
+
+def stage_timeout(name, default):
+    return float(os.getenv(f"STAGE_TIMEOUT_{name.upper()}", default))
+
+class Stage:
+    def __init__(self, name, fn, deps=(), timeout=40, fallback=None):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.timeout = stage_timeout(name, timeout)
+        self.fallback = fallback
+
+def run_pipeline(stages, question, emit=None):
+    # Schedules every stage as soon as its deps are done, so the wall time is
+    # the critical path rather than the sum of all calls. A stage that fails or
+    # misses its deadline resolves to its fallback and its dependents still run.
+    # When emit is given, stages stream their output through it as they go.
+    # A stage's clock starts when a worker picks it up, not while it queues.
+    # results["models"] records which model actually answered each stage,
+    # which can differ from the role's first choice after a hedge or failover.
+    results = {"question": question, "models": {}}
+    timings = {}
+    t0 = time.perf_counter()
+    waiting = {s.name: s for s in stages}
+    running = {}
+
+    while waiting or running:
+        for name, s in list(waiting.items()):
+            if all(d in results for d in s.deps):
+                del waiting[name]
+                info = {}
+                fut = pipeline_pool.submit(contextvars.copy_context().run, run_stage, s, results, emit, info)
+                running[fut] = (s, time.perf_counter(), info)
+        if not running:
+            raise RuntimeError(f"Unresolvable stage dependencies: {sorted(waiting)}")
+
+        deadlines = [info["started"] + s.timeout for s, _, info in running.values() if "started" in info]
+        queued = len(deadlines) < len(running)
+        timeout = max(0, min(deadlines) - time.perf_counter()) if deadlines else None
+        if queued:
+            timeout = STAGE_CANCEL_POLL if timeout is None else min(timeout, STAGE_CANCEL_POLL)
+        done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+        now = time.perf_counter()
+
+        for fut, (s, submitted, info) in list(running.items()):
+            error = None
+            started = info.get("started", now)
+            if fut in done:
+                try:
+                    value, status = fut.result(), "ok"
+                except Exception as e:
+                    print(f"❌ Stage {s.name} error:", e)
+                    value, status, error = s.fallback, "error", f"{type(e).__name__}: {e}"
+            elif now >= started + s.timeout:
+                info["cancelled"] = True
+                value, status, error = s.fallback, "timeout", "stage timed out"
+            else:
+                continue
+            del running[fut]
+            results[s.name] = value
+            timings[s.name] = {
+                "start": round(started - t0, 3),
+                "queued": round(started - submitted, 3),
+                "duration": round(now - started, 3),
+                "status": status,
+                "cached": info.get("cached", False)
+            }
+            if "model" in info:
+                results["models"][s.name] = info["model"]
+                timings[s.name]["model"] = info["model"]
+                timings[s.name]["attempts"] = info["attempts"]
+            if error:
+                timings[s.name]["error"] = error
+            if TRACING:
+                metrics.observe("ask_stage_seconds", now - started, stage=s.name, status=status)
+                log_event("stage", stage=s.name, **timings[s.name])
+            if emit:
+                emit("stage", {"name": s.name, "value": value, **timings[s.name]})
+
+    timings["total"] = round(time.perf_counter() - t0, 3)
+    return results, timings
+
+def run_stage(s, results, emit, info):
+    info["started"] = time.perf_counter()
+    stage_info.set(info)
+    return s.fn(results, stage_emitter(emit, info) if emit else None)
+
+def stage_emitter(emit, info):
+    # Drops output from a stage that already resolved to its fallback, and
+    # stops it by raising into whatever is producing the output.
+    def guarded(event, data):
+        if info.get("cancelled"):
+            raise StageCancelled()
+        emit(event, data)
+    return guarded
+
+def refined(r):
+    return r.get("refine") or r["question"]
+
+def deltas(emit, stage):
+    if emit is None:
         return None
+    return lambda text: emit("delta", {"stage": stage, "text": text})
+
+def merge_prompt(r):
+    # A model that failed or is circuit-broken is left out of the merge
+    # rather than having its error text treated as an answer.
+    models = r.get("models", {})
+    answers = [(models.get(key, name), r[key]) for name, key in (("GPT", "gpt"), ("DeepSeek", "deepseek")) if r[key]]
+    if not answers:
+        raise RuntimeError("No answers to merge")
+    said = "".join(f"{name} says:\n{text}\n\n" for name, text in answers)
+    verb = "combine" if len(answers) > 1 else "turn this"
+    return f"The user asked: {r['question']}\n\n{said}Now {verb} into a clear article (markdown)."
+
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "classic")
+PIPELINE_MODES = ("classic", "structured")
+
+class ArticleWithPrompts(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    article: str = Field(description="The merged article, in markdown")
+    image_prompts: list[str] = Field(min_length=2, max_length=2, description="Two vivid one-sentence image prompts")
+
+ARTICLE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "article_with_prompts", "strict": True, "schema": ArticleWithPrompts.model_json_schema()}
+}
+
+def is_well_formed(q):
+    # Cheap stand-in for the refine call: a full sentence of reasonable length
+    # that already reads as a question or request doesn't need rewording.
+    words = q.split()
+    return 5 <= len(words) <= 60 and q[0].isupper() and q[-1] in "?."
+
+def parse_image_prompts(text):
+    # Models tend to add a preamble ("Here are two prompts:") and number the
+    # prompts; when any line is a list item, only list items are kept.
+    items, lines = [], []
+    for line in text.splitlines():
+        stripped = re.sub(r"^\s*(?:[-*•]|\d+[.)]|(?:image\s+)?prompt\s*\d*\s*:)\s*", "", line, flags=re.I)
+        stripped = stripped.strip().strip('"*').strip()
+        if not stripped or stripped.endswith(":"):
+            continue
+        (items if stripped != line.strip() else lines).append(stripped)
+    return (items or lines)[:2]
+
+def write_image_prompts(article):
+    return parse_image_prompts(ask_gpt(
+        f"From the article below, generate *two* vivid image prompts (1 sentence each). Article:\n{article}",
+        role="prompt_writer", timeout=20
+    ))
+
+def compose(r):
+    # One merger call returns the article and both image prompts, replacing
+    # the separate prompt-writer round trip.
+    text = ask_gpt(
+        merge_prompt(r) + " Also write two vivid one-sentence image prompts illustrating it.",
+        role="merger", max_tokens=1200, response_format=ARTICLE_FORMAT
+    )
+    try:
+        return ArticleWithPrompts.model_validate_json(text).model_dump()
+    except ValidationError as e:
+        # Usually the output ran out of tokens mid-JSON, so the raw text is
+        # a fragment rather than an article. Merge again as plain text and
+        # let the prompts stage write the image prompts.
+        print(f"⚠️ Structured merge unparseable, retrying as plain text: {e.errors()[0]['type']}")
+        return {"article": ask_gpt(merge_prompt(r), role="merger"), "image_prompts": None}
+
+def build_pipeline(mode="classic"):
+    if mode == "structured":
+        return [
+            Stage("refine", lambda r, emit: r["question"] if is_well_formed(r["question"]) else ask_gpt(
+                f"Improve clarity: {r['question']}", role="refiner", timeout=20
+            ), timeout=20),
+            Stage("gpt", lambda r, emit: ask_gpt(f"Answer in detail:\n{refined(r)}", on_delta=deltas(emit, "gpt")),
+                  deps=("refine",)),
+            Stage("deepseek", lambda r, emit: ask_deepseek(f"Also answer:\n{refined(r)}", on_delta=deltas(emit, "deepseek")),
+                  deps=("refine",)),
+            Stage("compose", lambda r, emit: compose(r), deps=("gpt", "deepseek"),
+                  fallback={"article": "", "image_prompts": []}),
+            Stage("merge", lambda r, emit: r["compose"]["article"], deps=("compose",), fallback=""),
+            Stage("prompts", lambda r, emit: (
+                r["compose"]["image_prompts"] or write_image_prompts(r["merge"])
+            ) if r["merge"] else [], deps=("merge",), timeout=20, fallback=[]),
+            Stage("image_0", lambda r, emit: image_stage(r, 0), deps=("prompts",), timeout=60),
+            Stage("image_1", lambda r, emit: image_stage(r, 1), deps=("prompts",), timeout=60),
+        ]
+
+    return [
+        Stage("refine", lambda r, emit: ask_gpt(f"Improve clarity: {r['question']}", role="refiner", timeout=20), timeout=20),
+        Stage("gpt", lambda r, emit: ask_gpt(f"Answer in detail:\n{refined(r)}", on_delta=deltas(emit, "gpt")),
+              deps=("refine",)),
+        Stage("deepseek", lambda r, emit: ask_deepseek(f"Also answer:\n{refined(r)}", on_delta=deltas(emit, "deepseek")),
+              deps=("refine",)),
+        Stage("merge", lambda r, emit: ask_gpt(merge_prompt(r), role="merger", on_delta=deltas(emit, "merge")),
+              deps=("gpt", "deepseek"), fallback=""),
+        # No article means nothing to illustrate, so skip the prompt writer.
+        Stage("prompts", lambda r, emit: write_image_prompts(r["merge"]) if r["merge"] else [],
+              deps=("merge",), timeout=20, fallback=[]),
+        Stage("image_0", lambda r, emit: image_stage(r, 0), deps=("prompts",), timeout=60),
+        Stage("image_1", lambda r, emit: image_stage(r, 1), deps=("prompts",), timeout=60),
+    ]
+
+def pipeline_mode(body):
+    mode = body.get("pipeline") or PIPELINE_MODE
+    return mode if mode in PIPELINE_MODES else None
+
+def image_stage(r, i):
+    if i >= len(r["prompts"]):
+        return None
+    return generate_image(r["prompts"][i].strip())
+
+def build_images(r):
+    images = []
+    for i, p in enumerate(r["prompts"]):
+        images.append({"prompt": p.strip(), "url": r.get(f"image_{i}") or ""})
+    return images
+
+def wants_cache(body):
+    # Per-request bypass: {"cache": false} or a Cache-Control: no-cache header.
+    return not (body.get("cache") is False or "no-cache" in request.headers.get("Cache-Control", ""))
+
+def ask_response(r, timings, mode):
+    return {
+        "pipeline": mode,
+        "final": r["merge"],
+        "chatgpt_answer": r["gpt"] or f"[GPT Error]: {timings['gpt'].get('error')}",
+        "deepseek_answer": r["deepseek"] or f"[DeepSeek Error]: {timings['deepseek'].get('error')}",
+        "models": {key: r["models"][key] for key in ("gpt", "deepseek") if key in r["models"]},
+        "images": build_images(r),
+        "timings": timings
+    }
+
+JOBS_DB = os.getenv("JOBS_DB", os.path.join(tempfile.gettempdir(), "ask_jobs.sqlite3"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_QUEUE = int(os.getenv("JOB_MAX_QUEUE", "50"))
+JOB_MAX_PER_CLIENT = int(os.getenv("JOB_MAX_PER_CLIENT", "5"))
+JOB_RETRY_AFTER = int(os.getenv("JOB_RETRY_AFTER", "10"))
+JOB_RETENTION = int(os.getenv("JOB_RETENTION", "86400"))
+JOB_STALE_AFTER = int(os.getenv("JOB_STALE_AFTER", "300"))
+
+class QueueFull(Exception):
+    def __init__(self, reason, retry_after=JOB_RETRY_AFTER):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+class JobQueue:
+    # SQLite-backed so queued work survives a restart: a "running" job that
+    # hasn't made progress for JOB_STALE_AFTER seconds is taken to belong to a
+    # dead process and goes back in the queue. Several processes may share
+    # JOBS_DB; claim() makes sure only one of them runs each job.
+    def __init__(self, path, workers=JOB_WORKERS):
+        self.path = path
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.started = False
+        with self.connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY, client TEXT, qkey TEXT, question TEXT, use_cache INTEGER,
+                status TEXT, partial TEXT, result TEXT, error TEXT, created REAL, updated REAL)""")
+            columns = [row["name"] for row in db.execute("PRAGMA table_info(jobs)")]
+            if "mode" not in columns:
+                db.execute("ALTER TABLE jobs ADD COLUMN mode TEXT DEFAULT 'classic'")
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)")
+
+    @contextlib.contextmanager
+    def connect(self):
+        # Commits and closes, like SQLiteCache.connect.
+        db = sqlite3.connect(self.path, timeout=5)
+        db.row_factory = sqlite3.Row
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def submit(self, question, client, use_cache=True, mode="classic"):
+        qkey = cache_key("job", normalize_prompt(question), use_cache, mode)
+        now = time.time()
+        with self.lock, self.connect() as db:
+            db.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated < ?", (now - JOB_RETENTION,))
+            row = db.execute("SELECT id FROM jobs WHERE qkey = ? AND status IN ('queued', 'running')", (qkey,)).fetchone()
+            if row:
+                return row["id"], False
+
+            active = db.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+            if active >= JOB_MAX_QUEUE:
+                raise QueueFull("Job queue is full")
+            mine = db.execute("SELECT COUNT(*) FROM jobs WHERE client = ? AND status IN ('queued', 'running')", (client,)).fetchone()[0]
+            if mine >= JOB_MAX_PER_CLIENT:
+                raise QueueFull("Too many pending jobs for this client")
+
+            job_id = uuid.uuid4().hex
+            db.execute("""INSERT INTO jobs (id, client, qkey, question, use_cache, mode, status, partial, created, updated)
+                VALUES (?, ?, ?, ?, ?, ?, 'queued', '{}', ?, ?)""",
+                       (job_id, client, qkey, question, int(use_cache), mode, now, now))
+            self.ready.notify()
+        return job_id, True
+
+    def claim(self):
+        # Fairness: prefer the client with the fewest running jobs, then the
+        # oldest job, so one client's burst can't starve everyone else.
+        # The UPDATE only matches a job that is still queued, so if another
+        # process claimed it first we lose the race and pick again.
+        now = time.time()
+        with self.connect() as db:
+            db.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running' AND updated < ?", (now - JOB_STALE_AFTER,))
+            db.commit()
+            while True:
+                row = db.execute("""SELECT * FROM jobs j WHERE status = 'queued' ORDER BY
+                    (SELECT COUNT(*) FROM jobs r WHERE r.client = j.client AND r.status = 'running'), created
+                    LIMIT 1""").fetchone()
+                if row is None:
+                    return None
+                claimed = db.execute("UPDATE jobs SET status = 'running', updated = ? WHERE id = ? AND status = 'queued'",
+                                     (now, row["id"]))
+                db.commit()
+                if claimed.rowcount:
+                    return row
+
+    def update(self, job_id, **fields):
+        fields["updated"] = time.time()
+        for name in ("partial", "result"):
+            if name in fields:
+                fields[name] = json.dumps(fields[name])
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self.connect() as db:
+            db.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def get(self, job_id):
+        with self.connect() as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row["id"],
+            "status": row["status"],
+            "partial": json.loads(row["partial"] or "{}"),
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "created": row["created"],
+            "updated": row["updated"]
+        }
+
+    def ensure_workers(self):
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        for i in range(self.workers):
+            threading.Thread(target=self.work, name=f"ask-job-{i}", daemon=True).start()
+
+    def work(self):
+        while True:
+            with self.lock:
+                job = self.claim()
+                if job is None:
+                    self.ready.wait(timeout=1)
+                    continue
+            self.run(job)
+
+    def run(self, job):
+        partial = {}
+
+        def emit(event, data):
+            if event == "stage":
+                partial[data["name"]] = data["value"]
+                self.update(job["id"], partial=partial)
+
+        cache_enabled.set(bool(job["use_cache"]))
+        request_id.set(job["id"])
+        try:
+            r, timings = run_pipeline(build_pipeline(job["mode"]), job["question"], emit=emit)
+            self.update(job["id"], status="done", result=ask_response(r, timings, job["mode"]))
+        except Exception as e:
+            print(f"❌ Job {job['id']} error:", e)
+            self.update(job["id"], status="failed", error=str(e))
+
+job_queue = JobQueue(JOBS_DB)
+
+def client_id():
+    return request.headers.get("X-Client-Id") or request.remote_addr or "anonymous"
+
+def enqueue_question(q, use_cache, mode):
+    try:
+        job_id, created = job_queue.submit(q, client_id(), use_cache, mode)
+    except QueueFull as e:
+        response = jsonify({"error": str(e)})
+        response.status_code = 429
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response
+    job_queue.ensure_workers()
+    response = jsonify({"job_id": job_id, "status_url": f"/jobs/{job_id}", "deduplicated": not created})
+    response.status_code = 202
+    response.headers["Location"] = f"/jobs/{job_id}"
+    return response
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.before_request
+def assign_request_id():
+    request_id.set(request.headers.get("X-Request-Id") or uuid.uuid4().hex)
+
+@app.after_request
+def expose_request_id(response):
+    response.headers["X-Request-Id"] = request_id.get()
+    return response
 
 @app.route("/")
 def home():
@@ -72,34 +1208,126 @@ def handle_question():
         q = request.json.get("question", "").strip()
         if not q:
             return jsonify({"error": "No question provided"}), 400
+        mode = pipeline_mode(request.json)
+        if mode is None:
+            return jsonify({"error": f"pipeline must be one of {', '.join(PIPELINE_MODES)}"}), 400
 
-        better = ask_gpt(f"Improve clarity: {q}")
-       
-        gpt_ans = ask_gpt(f"Answer in detail:\n{better}")
-        ds_ans = ask_deepseek(f"Also answer:\n{better}")
-        
-        merged = ask_gpt(
-            f"The user asked: {q}\n\nGPT says:\n{gpt_ans}\n\nDeepSeek says:\n{ds_ans}\n\nNow combine into a clear article (markdown)."
-        )
-        
-        visual_prompts = ask_gpt(
-            f"From the article below, generate *two* vivid image prompts (1 sentence each). Article:\n{merged}"
-        ).split("\n")
-
-        
-        images = []
-        for p in visual_prompts[:2]:
-            img_b64 = generate_image(p.strip())
-            images.append({"prompt": p.strip(), "base64": img_b64 or ""})
-
-        return jsonify({
-            "final": merged,
-            "chatgpt_answer": gpt_ans,
-            "deepseek_answer": ds_ans,
-            "images": images
-        })
+        if request.args.get("mode") == "async":
+            return enqueue_question(q, wants_cache(request.json), mode)
+
+        cache_enabled.set(wants_cache(request.json))
+        r, timings = run_pipeline(build_pipeline(mode), q)
+
+        return jsonify(ask_response(r, timings, mode))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+@app.route("/ask/stream", methods=["POST"])
+def handle_question_stream():
+    body = request.json or {}
+    q = body.get("question", "").strip()
+    if not q:
+        return jsonify({"error": "No question provided"}), 400
+    mode = pipeline_mode(body)
+    if mode is None:
+        return jsonify({"error": f"pipeline must be one of {', '.join(PIPELINE_MODES)}"}), 400
+
+    cache_enabled.set(wants_cache(body))
+    ctx = contextvars.copy_context()
+    events = queue.Queue()
+
+    def run():
+        try:
+            r, timings = run_pipeline(build_pipeline(mode), q, emit=lambda event, data: events.put((event, data)))
+            events.put(("done", {"timings": timings}))
+        except Exception as e:
+            events.put(("error", {"error": str(e)}))
+        events.put(None)
+
+    def generate():
+        yield sse("start", {"question": q, "pipeline": mode})
+        threading.Thread(target=ctx.run, args=(run,), daemon=True).start()
+        while True:
+            try:
+                item = events.get(timeout=15)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            if item is None:
+                return
+            yield sse(*item)
+
+    return Response(generate(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    if job["status"] in ("queued", "running"):
+        job_queue.ensure_workers()
+    return jsonify(job)
+
+@app.route("/images/<digest>")
+def serve_image(digest):
+    if not re.fullmatch(r"[0-9a-f]{64}", digest) or not blob_store.exists(digest):
+        abort(404)
+    f = blob_store.open(digest)
+    head = f.read(4)
+    f.seek(0)
+    mimetype = next((m for magic, m in IMAGE_MIMETYPES if head.startswith(magic)), "application/octet-stream")
+
+    # wrap_file hands the file to wsgi.file_wrapper (sendfile where the server
+    # supports it and the store gave us a real file); make_conditional answers
+    # If-None-Match and Range requests.
+    response = Response(wrap_file(request.environ, f), mimetype=mimetype, direct_passthrough=True)
+    response.content_length = blob_store.size(digest)
+    response.set_etag(digest)
+    response.cache_control.public = True
+    response.cache_control.max_age = 31536000
+    response.cache_control.immutable = True
+    try:
+        return response.make_conditional(request, accept_ranges=True, complete_length=response.content_length)
+    except RequestedRangeNotSatisfiable:
+        f.close()
+        raise
+
+@app.route("/routes")
+def routes_status():
+    models = sorted({m for ms in MODEL_ROUTES.values() for m in ms})
+    return jsonify({
+        "routes": MODEL_ROUTES,
+        "order": {role: route_order(ms) for role, ms in MODEL_ROUTES.items()},
+        "hedging": HEDGING,
+        "models": {
+            m: {
+                "ttft": stats_for(m)["ttft"].snapshot(),
+                "total": stats_for(m)["total"].snapshot(),
+                "hedge_delay": hedge_delay(m),
+                "circuit_open": breaker_for(m).is_open()
+            } for m in models
+        }
+    })
+
+@app.route("/metrics")
+def metrics_endpoint():
+    with response_cache.lock:
+        cache = [(("ask_cache_events_total", (("event", k),)), v) for k, v in response_cache.stats.items()]
+    with breakers_lock:
+        circuits = [(("ask_circuit_open", (("model", m),)), int(b.is_open())) for m, b in breakers.items()]
+    return Response(metrics.render(cache, circuits), mimetype="text/plain; version=0.0.4")
+
+@app.route("/cache/stats")
+def cache_stats():
+    with response_cache.lock:
+        stats = dict(response_cache.stats)
+    stats["local_entries"] = len(response_cache.local)
+    stats["shared"] = type(response_cache.shared).__name__ if response_cache.shared else None
+    return jsonify(stats)
+
 @app.route("/test")
 def test():
     return "✅ Flask is working on Vercel!"
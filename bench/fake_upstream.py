@@ -0,0 +1,217 @@
+"""Local stand-in for OpenRouter and the Gemini image API.
+
+Point the app at it with:
+
+    OPENROUTER_BASE_URL=http://127.0.0.1:8001/v1 \
+    GENAI_BASE_URL=http://127.0.0.1:8001 \
+    OPENROUTER_API_KEY=fake python api/index.py
+
+and use the flags below to induce latency and errors. Every request draws
+its latency and failures from an RNG seeded by (--seed, model, prompt,
+attempt), so a run is reproducible regardless of how requests interleave.
+"""
+import argparse
+import base64
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 1x1 transparent PNG
+PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+)
+
+
+DISTRIBUTIONS = ("constant", "uniform", "normal", "lognormal", "exponential")
+
+
+class FakeUpstream(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = None
+    attempts = {}
+    attempts_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        if self.config.verbose:
+            super().log_message(format, *args)
+
+    def seed_rng(self, *parts):
+        key = "\x1f".join(str(p) for p in (self.config.seed, self.path, *parts))
+        with self.attempts_lock:
+            attempt = self.attempts[key] = self.attempts.get(key, 0) + 1
+        digest = hashlib.sha256(f"{key}\x1f{attempt}".encode()).digest()
+        self.rng = random.Random(int.from_bytes(digest[:8], "big"))
+
+    def random(self):
+        return self.rng.random()
+
+    def sample(self, mean):
+        # --jitter is the spread: half-width for uniform, stddev for normal,
+        # sigma of the underlying normal for lognormal.
+        spread, kind = self.config.jitter, self.config.distribution
+        if kind == "uniform":
+            return mean + spread * (2 * self.rng.random() - 1)
+        if kind == "normal":
+            return self.rng.gauss(mean, spread)
+        if kind == "lognormal":
+            return self.rng.lognormvariate(math.log(mean) - spread ** 2 / 2, spread) if mean > 0 else 0.0
+        if kind == "exponential":
+            return self.rng.expovariate(1 / mean) if mean > 0 else 0.0
+        return mean
+
+    def delay(self, seconds):
+        time.sleep(max(0.0, self.sample(seconds)))
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def maybe_fail(self):
+        if self.random() >= self.config.error_rate:
+            return False
+        headers = {}
+        if self.config.retry_after is not None:
+            headers["Retry-After"] = str(self.config.retry_after)
+        self.send_json(self.config.error_status, {"error": {"message": "injected failure"}}, headers)
+        return True
+
+    def do_POST(self):
+        try:
+            self.route()
+        except (BrokenPipeError, ConnectionResetError):
+            # The app hung up, e.g. it cancelled the losing side of a hedge.
+            self.close_connection = True
+
+    def route(self):
+        body = self.read_json()
+        self.seed_rng(body.get("model"), json.dumps(body.get("messages") or body.get("contents")))
+        if self.path.endswith("/chat/completions"):
+            self.delay(self.config.model_latency.get(body.get("model"), self.config.latency))
+            if not self.maybe_fail():
+                self.chat(body)
+        elif ":generateContent" in self.path:
+            self.delay(self.config.image_latency)
+            if not self.maybe_fail():
+                self.image()
+        else:
+            self.send_json(404, {"error": {"message": "not found"}})
+
+    def chat(self, body):
+        prompt = body["messages"][-1]["content"]
+        text = f"Fake answer from {body['model']} to: {prompt[:200]}"
+        schema = ((body.get("response_format") or {}).get("json_schema") or {}).get("schema")
+        if schema:
+            text = json.dumps(fill_schema(schema, text))
+        words = text.split(" ")
+        if not schema:
+            words = words[:body.get("max_tokens") or len(words)]
+        usage = {"prompt_tokens": len(prompt.split()), "completion_tokens": len(words)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        base = {"id": "chatcmpl-fake", "created": int(time.time()), "model": body["model"]}
+
+        if not body.get("stream"):
+            self.delay(self.config.token_delay * len(words))
+            self.send_json(200, {
+                **base,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": " ".join(words)}}],
+                "usage": usage
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        break_at = int(self.random() * len(words)) if self.random() < self.config.stream_error_rate else None
+        for i, word in enumerate(words):
+            if i == break_at:
+                # Drop the connection mid-stream without a terminating chunk.
+                self.close_connection = True
+                return
+            time.sleep(self.config.token_delay)
+            chunk = {**base, "object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+        final = {**base, "object": "chat.completion.chunk",
+                 "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        if (body.get("stream_options") or {}).get("include_usage"):
+            final["usage"] = usage
+        self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode())
+        self.close_connection = True
+
+    def image(self):
+        self.send_json(200, {"candidates": [{"content": {"parts": [
+            {"inlineData": {"mimeType": "image/png", "data": base64.b64encode(PNG).decode()}}
+        ]}}]})
+
+
+def fill_schema(schema, text):
+    # Just enough JSON Schema to answer structured-output requests.
+    kind = schema.get("type")
+    if kind == "object":
+        return {name: fill_schema(prop, f"{text} ({name})") for name, prop in schema.get("properties", {}).items()}
+    if kind == "array":
+        count = schema.get("minItems", 1)
+        return [fill_schema(schema.get("items", {}), f"{text} #{i + 1}") for i in range(count)]
+    if kind in ("integer", "number"):
+        return 0
+    if kind == "boolean":
+        return False
+    return text
+
+
+def serve(config):
+    config.model_latency = dict(config.model_latency)
+    handler = type("Handler", (FakeUpstream,), {"config": config, "attempts": {}})
+    server = ThreadingHTTPServer((config.host, config.port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def model_latency(value):
+    model, _, seconds = value.rpartition("=")
+    return model, float(seconds)
+
+
+def parser():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8001)
+    p.add_argument("--latency", type=float, default=0.2, help="seconds before a chat response starts")
+    p.add_argument("--model-latency", type=model_latency, action="append", default=[], metavar="MODEL=SECONDS",
+                   help="per-model chat latency, e.g. to make one model slow enough to be hedged")
+    p.add_argument("--image-latency", type=float, default=1.0, help="seconds per image")
+    p.add_argument("--token-delay", type=float, default=0.01, help="seconds between streamed tokens")
+    p.add_argument("--distribution", choices=DISTRIBUTIONS, default="uniform", help="shape of latency and image delays")
+    p.add_argument("--jitter", type=float, default=0.0, help="spread of the latency distribution")
+    p.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail")
+    p.add_argument("--stream-error-rate", type=float, default=0.0, help="fraction of streams cut off part way")
+    p.add_argument("--error-status", type=int, default=503)
+    p.add_argument("--retry-after", type=float, default=None, help="Retry-After seconds on failures")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--verbose", action="store_true")
+    return p
+
+
+if __name__ == "__main__":
+    config = parser().parse_args()
+    server = serve(config)
+    print(f"Fake upstream listening on http://{config.host}:{config.port}")
+    server.serve_forever()
@@ -0,0 +1,253 @@
+"""Load driver for the /ask pipeline.
+
+Starts bench/fake_upstream.py in-process, points the app at it, fires
+requests at a fixed concurrency through Flask's test client or a real
+threaded WSGI server, and writes throughput, latency percentiles, memory
+high-water mark and a per-stage breakdown as JSON on stdout (app logs and
+the --compare table go to stderr):
+
+    python bench/load.py --requests 200 --concurrency 16 --out before.json
+    python bench/load.py --requests 200 --concurrency 16 --compare before.json
+
+Flags not listed here are passed through to the mock (see
+`python bench/fake_upstream.py --help`).
+"""
+import argparse
+import contextlib
+import http.client
+import json
+import logging
+import math
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import fake_upstream  # noqa: E402
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    # Nearest rank: the smallest value with at least p% of the sample at or below it.
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def summarize(values):
+    if not values:
+        return None
+    return {
+        "mean": round(statistics.fmean(values), 4),
+        "p50": round(percentile(values, 50), 4),
+        "p95": round(percentile(values, 95), 4),
+        "p99": round(percentile(values, 99), 4),
+        "max": round(max(values), 4),
+    }
+
+
+def load_app(upstream_url, workdir):
+    # The app reads its configuration at import time, so the environment has
+    # to be in place before the first import.
+    os.environ.setdefault("OPENROUTER_API_KEY", "bench")
+    os.environ.setdefault("GENAI_API_KEY", "bench")
+    os.environ["OPENROUTER_BASE_URL"] = f"{upstream_url}/v1"
+    os.environ["GENAI_BASE_URL"] = upstream_url
+    os.environ.setdefault("CACHE_DB", os.path.join(workdir, "cache.sqlite3"))
+    os.environ.setdefault("JOBS_DB", os.path.join(workdir, "jobs.sqlite3"))
+    os.environ.setdefault("BLOB_DIR", os.path.join(workdir, "images"))
+    sys.path.insert(0, os.path.join(ROOT, "api"))
+    import index
+    return index
+
+
+class TestClientTarget:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def ask(self, path, body):
+        start = time.perf_counter()
+        response = self.client.post(path, json=body, buffered=False)
+        first_byte = None
+        chunks = []
+        for chunk in response.response:
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+            chunks.append(chunk if isinstance(chunk, bytes) else chunk.encode())
+        response.close()
+        return response.status_code, b"".join(chunks), first_byte, time.perf_counter() - start
+
+
+class WSGITarget:
+    def __init__(self, app):
+        from werkzeug.serving import make_server
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        self.server = make_server("127.0.0.1", 0, app, threaded=True)
+        self.port = self.server.server_port
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def ask(self, path, body):
+        start = time.perf_counter()
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=300)
+        conn.request("POST", path, json.dumps(body), {"Content-Type": "application/json"})
+        response = conn.getresponse()
+        chunks = [response.read1(65536)]
+        first_byte = time.perf_counter() - start
+        while True:
+            chunk = response.read1(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        conn.close()
+        return response.status, b"".join(chunks), first_byte, time.perf_counter() - start
+
+    def close(self):
+        self.server.shutdown()
+
+
+def parse_result(path, payload):
+    # Returns (timings, article). /ask answers 200 even when every stage
+    # failed, so the caller judges success by the merged article.
+    if path == "/ask":
+        body = json.loads(payload)
+        return body.get("timings", {}), body.get("final")
+    timings, article = {}, None
+    for frame in payload.decode().split("\n\n"):
+        event, _, data = frame.partition("\ndata: ")
+        if event == "event: stage":
+            stage = json.loads(data)
+            if stage["name"] == "merge":
+                article = stage["value"]
+        elif event == "event: done":
+            timings = json.loads(data)["timings"]
+    return timings, article
+
+
+def run(args, mock_args):
+    workdir = tempfile.mkdtemp(prefix="ask-bench-")
+    mock = fake_upstream.serve(fake_upstream.parser().parse_args(["--port", "0", "--seed", str(args.seed), *mock_args]))
+    threading.Thread(target=mock.serve_forever, daemon=True).start()
+    app = load_app(f"http://127.0.0.1:{mock.server_address[1]}", workdir).app
+
+    target = WSGITarget(app) if args.target == "wsgi" else TestClientTarget(app)
+    path = "/ask/stream" if args.stream else "/ask"
+    distinct = args.distinct or args.requests
+
+    def one(i):
+        body = {"question": f"Benchmark question {i % distinct}: how do tides work?", "pipeline": args.pipeline}
+        if args.no_cache:
+            body["cache"] = False
+        try:
+            status, payload, first_byte, elapsed = target.ask(path, body)
+            timings, article = parse_result(path, payload) if status == 200 else ({}, None)
+            if status == 200 and (timings.get("merge", {}).get("status") != "ok" or not article):
+                status = "merge_failed"
+            return {"status": status, "ttfb": first_byte, "latency": elapsed, "timings": timings}
+        except Exception as e:
+            return {"status": type(e).__name__, "ttfb": None, "latency": None, "timings": {}}
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    for i in range(args.warmup):
+        one(-1 - i)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(one, range(args.requests)))
+    wall = time.perf_counter() - started
+
+    if isinstance(target, WSGITarget):
+        target.close()
+    mock.shutdown()
+
+    ok = [r for r in results if r["status"] == 200]
+    stages = {}
+    stage_status = {}
+    for r in results:
+        for name, timing in r["timings"].items():
+            if name == "total":
+                continue
+            counts = stage_status.setdefault(name, {})
+            counts[timing["status"]] = counts.get(timing["status"], 0) + 1
+            if r["status"] == 200:
+                stages.setdefault(name, []).append(timing["duration"])
+
+    report = {
+        "config": {**vars(args), "mock": mock_args},
+        "commit": git_commit(),
+        "requests": len(results),
+        "ok": len(ok),
+        "errors": {str(s): sum(1 for r in results if r["status"] == s) for s in {r["status"] for r in results} - {200}},
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(ok) / wall, 3) if wall else None,
+        "latency": summarize([r["latency"] for r in ok]),
+        "ttfb": summarize([r["ttfb"] for r in ok if r["ttfb"] is not None]),
+        "stages": {name: summarize(values) for name, values in sorted(stages.items())},
+        "stage_status": dict(sorted(stage_status.items())),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    if args.tracemalloc:
+        report["tracemalloc_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+        tracemalloc.stop()
+    return report
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def compare(report, baseline):
+    rows = [("throughput_rps", report["throughput_rps"], baseline["throughput_rps"])]
+    for section in ("latency", "ttfb"):
+        for stat in ("p50", "p95", "p99"):
+            rows.append((f"{section}.{stat}", (report[section] or {}).get(stat), (baseline[section] or {}).get(stat)))
+    rows.append(("max_rss_mb", report["max_rss_mb"], baseline["max_rss_mb"]))
+
+    print(f"{'metric':<16}{'baseline':>12}{'current':>12}{'change':>10}", file=sys.stderr)
+    for name, current, before in rows:
+        change = f"{(current - before) / before * 100:+.1f}%" if current is not None and before else ""
+        print(f"{name:<16}{before if before is not None else '-':>12}{current if current is not None else '-':>12}{change:>10}", file=sys.stderr)
+
+
+def parser():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--requests", type=int, default=50)
+    p.add_argument("--concurrency", type=int, default=8)
+    p.add_argument("--warmup", type=int, default=2)
+    p.add_argument("--target", choices=("testclient", "wsgi"), default="testclient")
+    p.add_argument("--stream", action="store_true", help="drive /ask/stream instead of /ask")
+    p.add_argument("--pipeline", choices=("classic", "structured"), default="classic")
+    p.add_argument("--distinct", type=int, default=0, help="number of distinct questions (default: all distinct)")
+    p.add_argument("--no-cache", action="store_true", help="send cache: false with every request")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--tracemalloc", action="store_true", help="also report the Python heap peak (slower)")
+    p.add_argument("--out", help="write the JSON report here")
+    p.add_argument("--compare", help="baseline JSON report to compare against")
+    return p
+
+
+if __name__ == "__main__":
+    args, mock_args = parser().parse_known_args()
+    # The app logs with print(), so keep it off stdout and leave that for the report.
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run(args, mock_args)
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
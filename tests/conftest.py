@@ -0,0 +1,49 @@
+import os
+import sys
+import tempfile
+import threading
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+sys.path.insert(0, os.path.join(ROOT, "api"))
+
+import fake_upstream  # noqa: E402
+
+# The app reads its configuration at import time, so the mock upstream and
+# the environment have to be in place before the first import.
+upstream = fake_upstream.serve(fake_upstream.parser().parse_args(
+    ["--port", "0", "--latency", "0", "--image-latency", "0", "--token-delay", "0"]
+))
+threading.Thread(target=upstream.serve_forever, daemon=True).start()
+
+workdir = tempfile.mkdtemp(prefix="ask-tests-")
+upstream_url = f"http://127.0.0.1:{upstream.server_address[1]}"
+os.environ.update({
+    "OPENROUTER_API_KEY": "test",
+    "GENAI_API_KEY": "test",
+    "OPENROUTER_BASE_URL": f"{upstream_url}/v1",
+    "GENAI_BASE_URL": upstream_url,
+    "CACHE_SHARED": "none",
+    "JOBS_DB": os.path.join(workdir, "jobs.sqlite3"),
+    "BLOB_DIR": os.path.join(workdir, "images"),
+})
+
+import index  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(index, "response_cache", index.ResponseCache())
+    monkeypatch.setattr(index, "breakers", {})
+    monkeypatch.setattr(index, "model_stats", {})
+
+
+@pytest.fixture
+def mock_config():
+    config = upstream.RequestHandlerClass.config
+    saved = dict(vars(config))
+    config.model_latency = dict(config.model_latency)
+    yield config
+    vars(config).update(saved)
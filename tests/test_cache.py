@@ -0,0 +1,106 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import index
+
+
+def slow_compute(calls, value="answer", delay=0.2):
+    def compute():
+        calls.append(threading.current_thread().name)
+        time.sleep(delay)
+        return value
+    return compute
+
+
+def test_concurrent_identical_calls_share_one_compute():
+    cache = index.ResponseCache()
+    calls = []
+
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        values = list(pool.map(lambda _: cache.get_or_compute("key", slow_compute(calls)), range(5)))
+
+    assert values == ["answer"] * 5
+    assert len(calls) == 1
+    assert cache.stats["misses"] == 1
+    assert cache.stats["coalesced"] == 4
+    assert cache.get_or_compute("key", slow_compute(calls)) == "answer"
+    assert cache.stats["local_hits"] == 1
+
+
+def test_leader_error_reaches_followers_and_is_not_cached():
+    cache = index.ResponseCache()
+    started = threading.Event()
+
+    def failing():
+        started.set()
+        time.sleep(0.2)
+        raise RuntimeError("upstream down")
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        leader = pool.submit(cache.get_or_compute, "key", failing)
+        started.wait()
+        follower = pool.submit(cache.get_or_compute, "key", lambda: "unused")
+        for fut in (leader, follower):
+            with pytest.raises(RuntimeError, match="upstream down"):
+                fut.result()
+
+    assert cache.stats["coalesced"] == 1
+    assert cache.get_or_compute("key", lambda: "recovered") == "recovered"
+
+
+def test_different_keys_do_not_coalesce():
+    cache = index.ResponseCache()
+    calls = []
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        list(pool.map(lambda i: cache.get_or_compute(f"key-{i}", slow_compute(calls)), range(3)))
+
+    assert len(calls) == 3
+    assert cache.stats["coalesced"] == 0
+
+
+def test_shared_tier_is_read_by_other_instances(tmp_path):
+    shared = index.SQLiteCache(str(tmp_path / "cache.sqlite3"))
+    index.ResponseCache(shared=shared).get_or_compute("key", lambda: "answer")
+    other = index.ResponseCache(shared=shared)
+
+    assert other.get_or_compute("key", lambda: "recomputed") == "answer"
+    assert other.stats["shared_hits"] == 1
+
+
+def test_disabled_cache_always_computes():
+    cache = index.ResponseCache()
+    calls = []
+
+    def uncached():
+        index.cache_enabled.set(False)
+        return [cache.get_or_compute("key", slow_compute(calls, delay=0)) for _ in range(2)]
+
+    assert contextvars.copy_context().run(uncached) == ["answer", "answer"]
+    assert len(calls) == 2
+    assert cache.stats["bypassed"] == 2
+
+
+def test_shared_tier_closes_its_connections(tmp_path, monkeypatch):
+    opened = []
+    connect = index.sqlite3.connect
+
+    def tracking(*args, **kwargs):
+        db = connect(*args, **kwargs)
+        opened.append(db)
+        return db
+
+    monkeypatch.setattr(index.sqlite3, "connect", tracking)
+    shared = index.SQLiteCache(str(tmp_path / "cache.sqlite3"))
+    shared.set("key", "value", 60)
+    assert shared.get("key") == "value"
+    shared.delete("key")
+
+    assert len(opened) == 4
+    for db in opened:
+        with pytest.raises(index.sqlite3.ProgrammingError, match="closed"):
+            db.execute("SELECT 1")
@@ -0,0 +1,114 @@
+import hashlib
+import io
+
+import pytest
+
+import fake_upstream
+import index
+
+
+@pytest.fixture
+def client():
+    return index.app.test_client()
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = index.LocalBlobStore(str(tmp_path / "images"))
+    monkeypatch.setattr(index, "blob_store", store)
+    return store
+
+
+class MemoryBlobStore:
+    def __init__(self):
+        self.blobs = {}
+
+    def put(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        self.blobs[digest] = data
+        return digest
+
+    def exists(self, digest):
+        return digest in self.blobs
+
+    def url(self, digest):
+        return f"/images/{digest}"
+
+    def open(self, digest):
+        return io.BytesIO(self.blobs[digest])
+
+    def size(self, digest):
+        return len(self.blobs[digest])
+
+
+def test_serves_image_with_immutable_caching(client, store):
+    digest = store.put(fake_upstream.PNG)
+
+    response = client.get(f"/images/{digest}")
+
+    assert response.status_code == 200
+    assert response.data == fake_upstream.PNG
+    assert response.mimetype == "image/png"
+    assert response.content_length == len(fake_upstream.PNG)
+    assert response.get_etag() == (digest, False)
+    assert response.cache_control.public
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age == 31536000
+    assert response.headers["Accept-Ranges"] == "bytes"
+
+
+def test_matching_etag_is_not_modified(client, store):
+    digest = store.put(fake_upstream.PNG)
+
+    response = client.get(f"/images/{digest}", headers={"If-None-Match": f'"{digest}"'})
+
+    assert response.status_code == 304
+    assert response.data == b""
+
+
+def test_range_request(client, store):
+    digest = store.put(fake_upstream.PNG)
+
+    response = client.get(f"/images/{digest}", headers={"Range": "bytes=1-3"})
+
+    assert response.status_code == 206
+    assert response.data == fake_upstream.PNG[1:4]
+    assert response.headers["Content-Range"] == f"bytes 1-3/{len(fake_upstream.PNG)}"
+
+
+def test_unsatisfiable_range(client, store):
+    digest = store.put(fake_upstream.PNG)
+
+    response = client.get(f"/images/{digest}", headers={"Range": "bytes=1000-2000"})
+
+    assert response.status_code == 416
+
+
+@pytest.mark.parametrize("digest", ["0" * 64, "not-a-digest", "../" + "0" * 61])
+def test_unknown_or_malformed_digest(client, store, digest):
+    assert client.get(f"/images/{digest}").status_code == 404
+
+
+def test_unknown_bytes_are_octet_stream(client, store):
+    digest = store.put(b"plain bytes")
+
+    assert client.get(f"/images/{digest}").mimetype == "application/octet-stream"
+
+
+def test_serves_from_a_non_local_store(client, monkeypatch):
+    store = MemoryBlobStore()
+    monkeypatch.setattr(index, "blob_store", store)
+    digest = store.put(fake_upstream.PNG)
+
+    full = client.get(f"/images/{digest}")
+    partial = client.get(f"/images/{digest}", headers={"Range": "bytes=0-3"})
+
+    assert full.data == fake_upstream.PNG and full.mimetype == "image/png"
+    assert partial.status_code == 206 and partial.data == fake_upstream.PNG[:4]
+
+
+def test_pipeline_images_resolve_to_served_urls(client, store):
+    url = index.generate_image("A lighthouse at dusk")
+
+    assert url.startswith("/images/")
+    assert client.get(url).data == fake_upstream.PNG
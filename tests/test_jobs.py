@@ -0,0 +1,165 @@
+import threading
+import time
+
+import pytest
+
+import index
+
+
+@pytest.fixture
+def jobs(tmp_path, monkeypatch):
+    queue = index.JobQueue(str(tmp_path / "jobs.sqlite3"), workers=0)
+    monkeypatch.setattr(index, "job_queue", queue)
+    return queue
+
+
+def ask_async(client, question, client_id="alice"):
+    return client.post("/ask?mode=async", json={"question": question}, headers={"X-Client-Id": client_id})
+
+
+def test_identical_inflight_jobs_are_deduplicated(jobs):
+    first, created = jobs.submit("How do  tides work?", "alice")
+    again, created_again = jobs.submit("How do tides work?", "bob")
+
+    assert created and not created_again
+    assert again == first
+
+
+def test_finished_jobs_are_not_deduplicated(jobs):
+    first, _ = jobs.submit("How do tides work?", "alice")
+    jobs.update(first, status="done", result={})
+
+    again, created = jobs.submit("How do tides work?", "alice")
+
+    assert created and again != first
+
+
+def test_jobs_differing_in_cache_or_mode_are_separate(jobs):
+    ids = {
+        jobs.submit("How do tides work?", "alice")[0],
+        jobs.submit("How do tides work?", "alice", use_cache=False)[0],
+        jobs.submit("How do tides work?", "alice", mode="structured")[0],
+    }
+
+    assert len(ids) == 3
+
+
+def test_queue_full(jobs, monkeypatch):
+    monkeypatch.setattr(index, "JOB_MAX_QUEUE", 2)
+    jobs.submit("Question 1?", "alice")
+    jobs.submit("Question 2?", "bob")
+
+    with pytest.raises(index.QueueFull, match="queue is full"):
+        jobs.submit("Question 3?", "carol")
+    # A duplicate of a queued job is still accepted.
+    assert not jobs.submit("Question 1?", "carol")[1]
+
+
+def test_per_client_limit(jobs, monkeypatch):
+    monkeypatch.setattr(index, "JOB_MAX_PER_CLIENT", 2)
+    jobs.submit("Question 1?", "alice")
+    jobs.submit("Question 2?", "alice")
+
+    with pytest.raises(index.QueueFull, match="this client"):
+        jobs.submit("Question 3?", "alice")
+    assert jobs.submit("Question 3?", "bob")[1]
+
+
+def test_ask_async_answers_429_with_retry_after(jobs, monkeypatch):
+    monkeypatch.setattr(index, "JOB_MAX_PER_CLIENT", 1)
+    client = index.app.test_client()
+
+    accepted = ask_async(client, "Question 1?")
+    duplicate = ask_async(client, "Question 1?")
+    rejected = ask_async(client, "Question 2?")
+
+    assert accepted.status_code == 202
+    assert accepted.headers["Location"] == f"/jobs/{accepted.json['job_id']}"
+    assert duplicate.status_code == 202 and duplicate.json["deduplicated"]
+    assert rejected.status_code == 429
+    assert rejected.headers["Retry-After"] == str(index.JOB_RETRY_AFTER)
+    assert ask_async(client, "Question 2?", client_id="bob").status_code == 202
+
+
+def test_claim_prefers_clients_with_fewer_running_jobs(jobs):
+    jobs.submit("Alice 1?", "alice")
+    jobs.submit("Alice 2?", "alice")
+    jobs.submit("Bob 1?", "bob")
+
+    assert jobs.claim()["client"] == "alice"
+    assert jobs.claim()["client"] == "bob"
+    assert jobs.claim()["client"] == "alice"
+    assert jobs.claim() is None
+
+
+def test_worker_runs_job_to_completion(tmp_path, monkeypatch):
+    monkeypatch.setattr(index, "job_queue", index.JobQueue(str(tmp_path / "jobs.sqlite3"), workers=1))
+    client = index.app.test_client()
+
+    job_id = ask_async(client, "How do tides work?").json["job_id"]
+    deadline = time.monotonic() + 5
+    while (job := client.get(f"/jobs/{job_id}").json)["status"] in ("queued", "running") and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    assert job["status"] == "done"
+    assert job["result"]["final"]
+
+
+def test_queues_sharing_a_database_never_claim_a_job_twice(tmp_path):
+    path = str(tmp_path / "shared.sqlite3")
+    queues = [index.JobQueue(path, workers=0) for _ in range(2)]
+    for i in range(20):
+        queues[0].submit(f"Question {i}?", f"client-{i}")
+    claimed = []
+
+    def drain(queue):
+        while (job := queue.claim()) is not None:
+            claimed.append(job["id"])
+
+    threads = [threading.Thread(target=drain, args=(queues[i % 2],)) for i in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(claimed) == 20
+    assert len(set(claimed)) == 20
+
+
+def test_only_stale_running_jobs_are_requeued(tmp_path):
+    path = str(tmp_path / "shared.sqlite3")
+    first = index.JobQueue(path, workers=0)
+    stale, _ = first.submit("Stale?", "alice")
+    fresh, _ = first.submit("Fresh?", "bob")
+    assert {first.claim()["id"], first.claim()["id"]} == {stale, fresh}
+    with first.connect() as db:
+        db.execute("UPDATE jobs SET updated = ? WHERE id = ?", (time.time() - index.JOB_STALE_AFTER - 1, stale))
+
+    # A process starting up next to a live sibling leaves its fresh jobs alone.
+    second = index.JobQueue(path, workers=0)
+
+    assert second.claim()["id"] == stale
+    assert second.claim() is None
+    assert second.get(fresh)["status"] == "running"
+
+
+def test_job_queue_closes_its_connections(tmp_path, monkeypatch):
+    opened = []
+    connect = index.sqlite3.connect
+
+    def tracking(*args, **kwargs):
+        db = connect(*args, **kwargs)
+        opened.append(db)
+        return db
+
+    monkeypatch.setattr(index.sqlite3, "connect", tracking)
+    queue = index.JobQueue(str(tmp_path / "jobs.sqlite3"), workers=0)
+    job_id, _ = queue.submit("How do tides work?", "alice")
+    queue.claim()
+    queue.update(job_id, status="done", result={})
+    assert queue.get(job_id)["status"] == "done"
+
+    assert len(opened) == 5
+    for db in opened:
+        with pytest.raises(index.sqlite3.ProgrammingError, match="closed"):
+            db.execute("SELECT 1")
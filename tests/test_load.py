@@ -0,0 +1,20 @@
+import pytest
+
+import load
+
+
+@pytest.mark.parametrize("n, p, expected", [
+    (10, 50, 5),
+    (20, 95, 19),
+    (100, 99, 99),
+    (100, 100, 100),
+    (10, 0, 1),
+    (1, 99, 1),
+    (3, 50, 2),
+])
+def test_percentile_is_nearest_rank(n, p, expected):
+    assert load.percentile(list(range(n, 0, -1)), p) == expected
+
+
+def test_percentile_of_nothing():
+    assert load.percentile([], 50) is None
@@ -0,0 +1,125 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import index
+
+
+def test_stage_deadline_starts_when_a_worker_picks_it_up(monkeypatch):
+    monkeypatch.setattr(index, "pipeline_pool", ThreadPoolExecutor(max_workers=1))
+    stages = [
+        index.Stage("slow", lambda r, emit: time.sleep(0.6) or "slow", timeout=5),
+        index.Stage("fast", lambda r, emit: "fast", timeout=0.3, fallback="fallback"),
+    ]
+
+    results, timings = index.run_pipeline(stages, "q")
+
+    assert results["fast"] == "fast"
+    assert timings["fast"]["status"] == "ok"
+    assert timings["fast"]["queued"] >= 0.5
+
+
+def test_timed_out_stage_stops_emitting(monkeypatch):
+    events = []
+    stopped = threading.Event()
+
+    def chatty(r, emit):
+        on_delta = index.deltas(emit, "chatty")
+        try:
+            for _ in range(100):
+                on_delta("word ")
+                time.sleep(0.02)
+        finally:
+            stopped.set()
+
+    stages = [index.Stage("chatty", chatty, timeout=0.2, fallback="")]
+    results, timings = index.run_pipeline(stages, "q", emit=lambda event, data: events.append(event))
+
+    assert timings["chatty"]["status"] == "timeout"
+    assert stopped.wait(1)
+    assert events[-1] == "stage"
+    assert events.count("delta") < 20
+
+
+def test_timed_out_stage_cancels_its_upstream_call(mock_config, monkeypatch):
+    mock_config.token_delay = 0.05
+    monkeypatch.setattr(index, "MODEL_ROUTES", {**index.MODEL_ROUTES, "slow": ["test/slow-stream"]})
+    events = []
+
+    def answer(r, emit):
+        return index.ask_gpt("Tell me a long story " + "please " * 40, role="slow", on_delta=index.deltas(emit, "answer"))
+
+    stages = [index.Stage("answer", answer, timeout=0.2, fallback="")]
+    results, timings = index.run_pipeline(stages, "q", emit=lambda event, data: events.append(event))
+    count = events.count("delta")
+    time.sleep(0.5)
+
+    assert timings["answer"]["status"] == "timeout"
+    assert events.count("delta") == count
+    assert not index.breaker_for("test/slow-stream").failures
+
+
+def test_structured_merge_falls_back_to_plain_text(monkeypatch):
+    chat = index.chat
+
+    def truncated(prompt, role, timeout=40, on_delta=None, max_tokens=800, response_format=None):
+        if response_format:
+            return '{"article": "# Tides\\n\\nThe moon pu'
+        return chat(prompt, role, timeout, on_delta, max_tokens)
+
+    monkeypatch.setattr(index, "chat", truncated)
+
+    results, timings = index.run_pipeline(index.build_pipeline("structured"), "How do tides work?")
+
+    assert results["merge"].startswith("Fake answer from")
+    assert len(results["prompts"]) == 2
+    assert timings["prompts"]["status"] == "ok"
+
+
+def test_answers_are_labelled_with_the_model_that_wrote_them(monkeypatch):
+    monkeypatch.setattr(index, "MODEL_ROUTES", {**index.MODEL_ROUTES, "alt_answerer": ["test/down", "test/alt"]})
+    for _ in range(index.BREAKER_THRESHOLD):
+        index.breaker_for("test/down").failure()
+
+    results, timings = index.run_pipeline(index.build_pipeline(), "How do tides work?")
+
+    assert results["models"]["deepseek"] == "test/alt"
+    assert "test/alt says:" in index.merge_prompt(results)
+    assert "DeepSeek says:" not in index.merge_prompt(results)
+
+
+def test_failed_images_are_reported_as_errors(monkeypatch):
+    def broken(prompt, timeout=60):
+        raise RuntimeError("no image today")
+
+    monkeypatch.setattr(index, "generate_image_upstream", broken)
+
+    results, timings = index.run_pipeline(index.build_pipeline(), "How do tides work?")
+
+    for name in ("image_0", "image_1"):
+        assert timings[name]["status"] == "error"
+        assert "no image today" in timings[name]["error"]
+        assert results[name] is None
+
+
+@pytest.mark.parametrize("mode", index.PIPELINE_MODES)
+def test_no_image_prompts_without_an_article(mode, monkeypatch):
+    roles = []
+    chat = index.chat
+
+    def answerers_down(prompt, role, *args):
+        roles.append(role)
+        if role in ("answerer", "alt_answerer"):
+            raise RuntimeError(f"{role} down")
+        return chat(prompt, role, *args)
+
+    monkeypatch.setattr(index, "chat", answerers_down)
+
+    results, timings = index.run_pipeline(index.build_pipeline(mode), "How do tides work?")
+
+    assert results["merge"] == ""
+    assert results["prompts"] == []
+    assert "prompt_writer" not in roles
+    assert results["image_0"] is None and results["image_1"] is None
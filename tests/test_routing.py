@@ -0,0 +1,45 @@
+import time
+
+import pytest
+
+import index
+
+
+def test_hedged_loser_is_sampled_but_keeps_its_place(mock_config, monkeypatch):
+    mock_config.model_latency.update({"test/slow": 0.4, "test/fast": 0.0})
+    monkeypatch.setattr(index, "HEDGE_DEFAULT_DELAY", 0.05)
+    models = ["test/slow", "test/fast"]
+
+    for i in range(index.HEDGE_MIN_SAMPLES):
+        assert "test/fast" in index.route_chat(models, f"Question {i}?")
+    time.sleep(0.5)
+
+    assert index.stats_for("test/slow")["ttft"].samples == index.HEDGE_MIN_SAMPLES
+    assert index.hedge_delay("test/slow") >= 0.35
+    assert index.route_order(models) == models
+
+
+def test_route_order_skips_open_circuits():
+    for _ in range(index.BREAKER_THRESHOLD):
+        index.breaker_for("test/broken").failure()
+
+    assert index.route_order(["test/broken", "test/ok"]) == ["test/ok"]
+    assert index.route_order(["test/broken"]) == ["test/broken"]
+
+
+def test_timeout_cancels_attempts(monkeypatch):
+    deltas = []
+
+    def late_chat_once(prompt, model, timeout, on_delta, max_tokens, response_format):
+        time.sleep(0.3)
+        on_delta("late")
+        return "late"
+
+    monkeypatch.setattr(index, "chat_once", late_chat_once)
+    monkeypatch.setattr(index, "HEDGE_DEFAULT_DELAY", 0.05)
+
+    with pytest.raises(TimeoutError):
+        index.route_chat(["test/a", "test/b"], "Anyone there?", timeout=0.1, on_delta=deltas.append)
+    time.sleep(0.4)
+
+    assert deltas == []
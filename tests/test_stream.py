@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+import index
+
+
+@pytest.fixture
+def client():
+    return index.app.test_client()
+
+
+def events(response):
+    parsed = []
+    for frame in response.get_data(as_text=True).split("\n\n"):
+        if frame.startswith("event: "):
+            event, _, data = frame.partition("\ndata: ")
+            parsed.append((event[len("event: "):], json.loads(data)))
+    return parsed
+
+
+def test_stream_event_order(client):
+    response = client.post("/ask/stream", json={"question": "How do tides work?"})
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    assert response.headers["Cache-Control"] == "no-cache"
+    stream = events(response)
+    kinds = [event if event != "stage" else f"stage:{data['name']}" for event, data in stream]
+
+    assert kinds[0] == "start" and stream[0][1] == {"question": "How do tides work?", "pipeline": "classic"}
+    assert kinds[1] == "stage:refine"
+    assert kinds[-1] == "done"
+    order = [k for k in kinds if k.startswith("stage:")]
+    assert order.index("stage:merge") > max(order.index("stage:gpt"), order.index("stage:deepseek"))
+    assert order.index("stage:prompts") > order.index("stage:merge")
+    assert min(order.index("stage:image_0"), order.index("stage:image_1")) > order.index("stage:prompts")
+    assert set(stream[-1][1]["timings"]) == {"refine", "gpt", "deepseek", "merge", "prompts", "image_0", "image_1", "total"}
+
+
+def test_stream_deltas_precede_and_add_up_to_each_stage(client):
+    stream = events(client.post("/ask/stream", json={"question": "How do tides work?"}))
+
+    for name in ("gpt", "deepseek", "merge"):
+        done_at = next(i for i, (event, data) in enumerate(stream) if event == "stage" and data["name"] == name)
+        text = "".join(data["text"] for event, data in stream[:done_at] if event == "delta" and data["stage"] == name)
+        assert text
+        assert text.strip() == stream[done_at][1]["value"]
+        assert not any(event == "delta" and data["stage"] == name for event, data in stream[done_at:])
+
+
+def test_stream_structured_pipeline(client):
+    stream = events(client.post("/ask/stream", json={"question": "How do tides work?", "pipeline": "structured"}))
+
+    assert stream[0][1]["pipeline"] == "structured"
+    assert "compose" in {data["name"] for event, data in stream if event == "stage"}
+    assert stream[-1][0] == "done"
+
+
+def test_stream_reports_pipeline_errors(client, monkeypatch):
+    def broken(stages, question, emit=None):
+        raise RuntimeError("scheduler broke")
+
+    monkeypatch.setattr(index, "run_pipeline", broken)
+
+    stream = events(client.post("/ask/stream", json={"question": "How do tides work?"}))
+
+    assert [event for event, _ in stream] == ["start", "error"]
+    assert stream[-1][1] == {"error": "scheduler broke"}
+
+
+@pytest.mark.parametrize("body, error", [
+    ({}, "No question provided"),
+    ({"question": "   "}, "No question provided"),
+    ({"question": "Why?", "pipeline": "fancy"}, "pipeline must be one of classic, structured"),
+])
+def test_stream_rejects_bad_requests(client, body, error):
+    response = client.post("/ask/stream", json=body)
+
+    assert response.status_code == 400
+    assert response.json == {"error": error}
@@ -0,0 +1,23 @@
+import index
+
+
+def test_pipeline_runs_with_tracing_off(monkeypatch):
+    monkeypatch.setattr(index, "TRACING", False)
+
+    results, timings = index.run_pipeline(index.build_pipeline(), "How do tides work?")
+
+    assert {name: t["status"] for name, t in timings.items() if name != "total"} == dict.fromkeys(
+        ("refine", "gpt", "deepseek", "merge", "prompts", "image_0", "image_1"), "ok")
+    assert results["merge"]
+    assert all(results[f"image_{i}"].startswith("/images/") for i in range(2))
+
+
+def test_span_records_cache_hit_label(monkeypatch):
+    observed = []
+    monkeypatch.setattr(index.metrics, "observe", lambda name, value, **labels: observed.append((name, labels)))
+
+    index.ask_gpt("Same question twice?")
+    index.ask_gpt("Same question twice?")
+
+    calls = [labels["cache_hit"] for name, labels in observed if name == "ask_call_seconds"]
+    assert calls == ["false", "true"]
@@ -0,0 +1,157 @@
+import time
+from email.utils import formatdate
+
+import httpx
+import pytest
+
+import index
+
+
+def status_error(status, retry_after=None):
+    headers = {"Retry-After": retry_after} if retry_after is not None else {}
+    request = httpx.Request("POST", "http://upstream.test/v1/chat/completions")
+    return httpx.HTTPStatusError("upstream error", request=request, response=httpx.Response(status, headers=headers, request=request))
+
+
+def flaky(*errors, result="ok"):
+    errors = list(errors)
+    calls = []
+
+    def fn():
+        calls.append(time.perf_counter())
+        if errors:
+            raise errors.pop(0)
+        return result
+    fn.calls = calls
+    return fn
+
+
+def test_breaker_opens_after_threshold_failures():
+    breaker = index.CircuitBreaker(threshold=3, cooldown=60)
+    for _ in range(2):
+        breaker.failure()
+    assert breaker.allow() and not breaker.is_open()
+
+    breaker.failure()
+
+    assert breaker.is_open()
+    assert not breaker.allow()
+
+
+def test_breaker_half_opens_for_one_trial_after_cooldown():
+    breaker = index.CircuitBreaker(threshold=1, cooldown=0.1)
+    breaker.failure()
+    time.sleep(0.15)
+
+    assert not breaker.is_open()
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_breaker_closes_on_trial_success():
+    breaker = index.CircuitBreaker(threshold=1, cooldown=0.1)
+    breaker.failure()
+    time.sleep(0.15)
+    breaker.allow()
+
+    breaker.success()
+
+    assert not breaker.is_open()
+    assert breaker.allow() and breaker.allow()
+
+
+def test_breaker_reopens_on_trial_failure():
+    breaker = index.CircuitBreaker(threshold=2, cooldown=0.1)
+    breaker.failure()
+    breaker.failure()
+    time.sleep(0.15)
+    breaker.allow()
+
+    breaker.failure()
+
+    assert breaker.is_open()
+    assert not breaker.allow()
+
+
+def test_breaker_hold_never_shortens_an_open_circuit():
+    breaker = index.CircuitBreaker(threshold=1, cooldown=60)
+    breaker.failure()
+
+    breaker.hold(0.01)
+    time.sleep(0.05)
+
+    assert breaker.is_open()
+
+
+def test_call_upstream_fails_fast_while_open(monkeypatch):
+    monkeypatch.setattr(index, "jittered_backoff", lambda retry_state: 0)
+    for _ in range(index.BREAKER_THRESHOLD):
+        with pytest.raises(httpx.HTTPStatusError):
+            index.call_upstream("test/down", flaky(*[status_error(500)] * index.UPSTREAM_RETRIES))
+    fn = flaky()
+
+    with pytest.raises(index.CircuitOpen):
+        index.call_upstream("test/down", fn)
+    assert fn.calls == []
+
+
+def test_client_errors_are_not_retried_or_counted():
+    fn = flaky(status_error(400))
+
+    with pytest.raises(httpx.HTTPStatusError):
+        index.call_upstream("test/bad-request", fn)
+
+    assert len(fn.calls) == 1
+    assert index.breaker_for("test/bad-request").failures == 0
+
+
+def test_retry_waits_for_retry_after(monkeypatch):
+    monkeypatch.setattr(index, "jittered_backoff", lambda retry_state: 0.01)
+    fn = flaky(status_error(429, "0.3"))
+
+    assert index.call_upstream("test/limited", fn) == "ok"
+
+    assert 0.3 <= fn.calls[1] - fn.calls[0] < 0.5
+
+
+def test_retry_after_beyond_max_backoff_is_not_retried_early(monkeypatch):
+    monkeypatch.setattr(index, "UPSTREAM_MAX_BACKOFF", 0.2)
+    fn = flaky(status_error(429, "120"))
+
+    with pytest.raises(httpx.HTTPStatusError):
+        index.call_upstream("test/limited", fn)
+
+    assert len(fn.calls) == 1
+    breaker = index.breaker_for("test/limited")
+    assert breaker.is_open()
+    with pytest.raises(index.CircuitOpen):
+        index.call_upstream("test/limited", flaky())
+
+
+def test_breaker_hold_lasts_as_long_as_retry_after(monkeypatch):
+    monkeypatch.setattr(index, "UPSTREAM_MAX_BACKOFF", 0.1)
+    with pytest.raises(httpx.HTTPStatusError):
+        index.call_upstream("test/limited", flaky(status_error(503, "0.3")))
+    assert index.breaker_for("test/limited").is_open()
+
+    time.sleep(0.35)
+
+    assert index.call_upstream("test/limited", flaky()) == "ok"
+    assert not index.breaker_for("test/limited").is_open()
+
+
+def test_backoff_applies_when_retry_after_is_shorter(monkeypatch):
+    monkeypatch.setattr(index, "jittered_backoff", lambda retry_state: 0.3)
+    fn = flaky(status_error(503, "0"))
+
+    assert index.call_upstream("test/limited", fn) == "ok"
+
+    assert fn.calls[1] - fn.calls[0] >= 0.3
+
+
+def test_retry_after_parses_seconds_and_http_dates():
+    assert index.retry_after(status_error(429, "2.5")) == 2.5
+    assert 25 < index.retry_after(status_error(429, formatdate(time.time() + 30, usegmt=True))) <= 30
+    assert index.retry_after(status_error(429, formatdate(time.time() - 30, usegmt=True))) == 0.0
+    assert index.retry_after(status_error(429, "soon")) is None
+    assert index.retry_after(status_error(429)) is None